@@ -0,0 +1,300 @@
+"""
+Shared helpers for the Finnhub -> Discord alert scripts
+API key rotation and rate limiting, the HTTP session, the response cache,
+history files and Discord delivery
+"""
+
+import os
+import hashlib
+import itertools
+import json
+import requests
+import threading
+import time
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+FINNHUB_API_KEY = os.getenv('FINNHUB_API_KEY')
+FINNHUB_API_KEY_2 = os.getenv('FINNHUB_API_KEY_2')
+FINNHUB_API_KEY_3 = os.getenv('FINNHUB_API_KEY_3')
+FINNHUB_BASE_URL = 'https://finnhub.io/api/v1'
+
+# Concurrency - symbols are fetched in parallel, with a token bucket per API
+# key keeping each key inside Finnhub's rate limit.
+# Finnhub allows 60 API calls per minute per key; using 50 for safety buffer
+MAX_WORKERS = 8
+CALLS_PER_MINUTE_PER_KEY = 50
+RATE_LIMIT_BURST = 5  # Calls per key allowed back-to-back before pacing kicks in
+KEY_COOLDOWN_SECONDS = 60  # How long to rest a key after Finnhub returns 429
+
+# On-disk cache for Finnhub responses that change slowly. The workflow
+# restores this directory between runs with actions/cache.
+CACHE_DIR = '.cache/finnhub'
+
+# Watchlist shared by the per-symbol scripts
+WATCHLIST = (
+    'ABBV', 'ABT', 'ADBE', 'AEO', 'ALAB', 'ALGN', 'ALGT', 'AMD',
+    'AMZN', 'APP', 'ASTS', 'BA', 'BABA', 'BE', 'BULL',
+    'CDNS', 'CFLT', 'CMCL', 'CNC', 'COIN', 'COP', 'CPNG',
+    'CRWV', 'CSCO', 'CVNA', 'CVS', 'CVX', 'DUOL',
+    'ENPH', 'FIG', 'FLR', 'GE', 'GME', 'GOOGL',
+    'HIMS', 'HOOD', 'IBM', 'IBRX', 'INTC', 'IONQ',
+    'IREN', 'JNJ', 'JOBY', 'KO', 'LCID',
+    'LLY', 'LMND', 'LNTH', 'LYFT', 'MARA',
+    'META', 'MRVL', 'MSFT', 'MU', 'NEE',
+    'NFLX', 'NKE', 'NRG', 'NVAX', 'NVDA',
+    'OKLO', 'ONC', 'OPEN', 'ORCL', 'PANW',
+    'PATH', 'PEP', 'PDD', 'PFE', 'PLTR',
+    'PYPL', 'QBTS', 'QCOM', 'RGTI', 'RKLB',
+    'RR', 'SHOP', 'SMCI', 'SMR', 'SNOW',
+    'SOFI', 'SOUN', 'SPOT', 'SYNA', 'TEM',
+    'TMC', 'TSLA', 'TSM', 'TTD', 'UBER',
+    'UAMY', 'UNH', 'USAR', 'UUUU', 'XOM',
+    'XPEV', 'Z', 'ZBRA'
+)
+
+# Discord allows max 10 embeds per message
+DISCORD_BATCH_SIZE = 10
+
+# Create list of API keys (filter out None values)
+API_KEYS = [key for key in [FINNHUB_API_KEY, FINNHUB_API_KEY_2, FINNHUB_API_KEY_3] if key]
+api_key_cycle = itertools.cycle(API_KEYS)
+api_key_lock = threading.Lock()
+
+# Token bucket per API key, refilled at CALLS_PER_MINUTE_PER_KEY. A key that
+# Finnhub rate-limits anyway is benched until cooldown_until.
+key_buckets = {
+    key: {'tokens': RATE_LIMIT_BURST, 'updated': time.monotonic(), 'cooldown_until': 0.0}
+    for key in API_KEYS
+}
+
+def get_next_api_key():
+    """Round-robin to the next API key with rate limit budget, sleeping only if all are spent"""
+    tokens_per_second = CALLS_PER_MINUTE_PER_KEY / 60
+    while True:
+        with api_key_lock:
+            now = time.monotonic()
+            wait_time = None
+            for _ in range(len(API_KEYS)):
+                key = next(api_key_cycle)
+                bucket = key_buckets[key]
+                if now < bucket['cooldown_until']:
+                    key_wait = bucket['cooldown_until'] - now
+                else:
+                    elapsed = now - bucket['updated']
+                    bucket['tokens'] = min(RATE_LIMIT_BURST, bucket['tokens'] + elapsed * tokens_per_second)
+                    bucket['updated'] = now
+                    if bucket['tokens'] >= 1:
+                        bucket['tokens'] -= 1
+                        return key
+                    key_wait = (1 - bucket['tokens']) / tokens_per_second
+                wait_time = key_wait if wait_time is None else min(wait_time, key_wait)
+        time.sleep(wait_time)
+
+def cool_down_api_key(key, seconds=KEY_COOLDOWN_SECONDS):
+    """Take a key that hit Finnhub's rate limit out of rotation for the given seconds"""
+    with api_key_lock:
+        bucket = key_buckets[key]
+        bucket['cooldown_until'] = time.monotonic() + seconds
+        bucket['tokens'] = 0
+
+def seconds_until_reset(response):
+    """Seconds until the key's quota resets per X-Ratelimit-Reset, capped at KEY_COOLDOWN_SECONDS"""
+    try:
+        reset_at = float(response.headers['X-Ratelimit-Reset'])  # Unix epoch seconds
+    except (KeyError, TypeError, ValueError):
+        return KEY_COOLDOWN_SECONDS
+    return min(max(reset_at - time.time(), 0.0), KEY_COOLDOWN_SECONDS)
+
+# Shared HTTP session so TCP/TLS connections to Finnhub and Discord are reused.
+# Server errors on GET requests are retried with exponential backoff. Retry-After
+# is ignored, as urllib3 would otherwise retry a 429 carrying it on the same key;
+# 429s are left to finnhub_get, which retries on a different API key instead.
+RETRY_POLICY = Retry(
+    total=3,
+    backoff_factor=1,
+    status_forcelist=[500, 502, 503, 504],
+    respect_retry_after_header=False,
+    raise_on_status=False
+)
+SESSION = requests.Session()
+SESSION.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=RETRY_POLICY))
+
+
+def finnhub_get(endpoint, params, description, max_retries=3):
+    """
+    GET a Finnhub endpoint with a rate-limited API key and return the decoded JSON.
+
+    A 429 benches the key until Finnhub says its quota resets and retries straight
+    away on the next one; a response reporting no calls left benches the key the
+    same way. Any other error is printed using description and None is returned.
+    """
+    url = f"{FINNHUB_BASE_URL}/{endpoint}"
+
+    for attempt in range(max_retries):
+        token = get_next_api_key()
+
+        try:
+            response = SESSION.get(url, params={**params, 'token': token}, timeout=10)
+            response.raise_for_status()
+            if response.headers.get('X-Ratelimit-Remaining') == '0':
+                cool_down_api_key(token, seconds_until_reset(response))
+            return response.json()
+        except requests.exceptions.HTTPError as e:
+            if e.response.status_code == 429:
+                # Retry right away on another key instead of sleeping on this one
+                print("  Rate limit hit, rotating API key...")
+                cool_down_api_key(token, seconds_until_reset(e.response))
+                continue
+            else:
+                print(f"Error fetching {description}: {e}")
+                return None
+        except Exception as e:
+            print(f"Error fetching {description}: {e}")
+            return None
+
+    print(f"  Failed after {max_retries} retries")
+    return None
+
+
+def cached_finnhub_get(endpoint, params, description, ttl_seconds):
+    """
+    finnhub_get with an on-disk cache, keyed by endpoint and params.
+
+    A cached response younger than ttl_seconds is returned without touching
+    the API. Failed fetches are not cached, so the next run tries again.
+    """
+    cache_key = json.dumps([endpoint, sorted(params.items())])
+    cache_file = os.path.join(CACHE_DIR, hashlib.md5(cache_key.encode()).hexdigest() + '.json')
+
+    try:
+        if time.time() - os.path.getmtime(cache_file) < ttl_seconds:
+            with open(cache_file, 'r') as f:
+                return json.load(f)
+    except (OSError, ValueError):
+        pass  # Missing, unreadable or expired - fetch fresh
+
+    data = finnhub_get(endpoint, params, description)
+    if data is not None:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        tmp_file = f"{cache_file}.{threading.get_ident()}.tmp"
+        with open(tmp_file, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp_file, cache_file)
+    return data
+
+
+def load_history(path):
+    """Load a history file, starting fresh if it is missing or unreadable"""
+    if os.path.exists(path):
+        try:
+            with open(path, 'r') as f:
+                content = f.read().strip()
+                if content:
+                    return json.loads(content)
+                else:
+                    return {}
+        except (json.JSONDecodeError, ValueError) as e:
+            print(f"Warning: Could not parse history file, starting fresh: {e}")
+            return {}
+    return {}
+
+
+def save_history(path, history):
+    """
+    Save a history file atomically so a crash can't leave a truncated file.
+
+    Each record is written compactly on its own line. That is 25-30% smaller
+    than indent=2, and the committed files still diff one record per line.
+    Nothing is written when the file already holds the same content.
+    """
+    lines = [
+        f"{json.dumps(key)}:{json.dumps(record, separators=(',', ':'))}"
+        for key, record in history.items()
+    ]
+    content = '{\n' + ',\n'.join(lines) + '\n}\n' if lines else '{}\n'
+
+    try:
+        with open(path, 'r') as f:
+            if f.read() == content:
+                return
+    except OSError:
+        pass  # No existing file to compare against
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_file = path + '.tmp'
+    with open(tmp_file, 'w') as f:
+        f.write(content)
+    os.replace(tmp_file, path)
+
+
+def prune_history(history, cutoff_iso, field='first_seen'):
+    """
+    Drop records whose field timestamp is on or before cutoff_iso.
+
+    Records are only ever added with the current time, so the history dict
+    (and the JSON file it round-trips through) is ordered by that field.
+    Expired records are all at the front, and the scan stops at the first
+    record still inside the retention window.
+    """
+    expired = []
+    for key, record in history.items():
+        if record.get(field, '') > cutoff_iso:
+            break
+        expired.append(key)
+    for key in expired:
+        del history[key]
+
+
+def send_discord_alert(webhook, embeds, max_retries=3):
+    """
+    Send embeds to Discord in batches, pacing by Discord's rate limit headers.
+
+    webhook may hold several comma-separated webhook URLs. Batches are then
+    spread round-robin across them, each paced by its own rate limit bucket.
+    A batch that fails is reported and skipped so the rest still go out.
+    Returns True only if every batch was delivered.
+    """
+    webhooks = [url.strip() for url in (webhook or '').split(',') if url.strip()]
+    if not webhooks:
+        print("Discord webhook not configured")
+        return False
+
+    total_sent = 0
+    resume_at = {}  # Webhook URL -> monotonic time its exhausted bucket refills
+
+    for batch_number, i in enumerate(range(0, len(embeds), DISCORD_BATCH_SIZE)):
+        url = webhooks[batch_number % len(webhooks)]
+        batch = embeds[i:i + DISCORD_BATCH_SIZE]
+        payload = {"embeds": batch}
+        response = None
+
+        # Only wait when Discord reported this webhook's bucket as exhausted
+        wait_time = resume_at.get(url, 0) - time.monotonic()
+        if wait_time > 0:
+            time.sleep(wait_time)
+
+        for attempt in range(max_retries):
+            try:
+                response = SESSION.post(url, json=payload, timeout=10)
+                if response.status_code == 429:  # Rate limit hit
+                    wait_time = float(response.headers.get('Retry-After', 1))
+                    print(f"  Discord rate limit hit, waiting {wait_time}s...")
+                    time.sleep(wait_time)
+                    continue
+                response.raise_for_status()
+                total_sent += len(batch)
+                print(f"Sent batch of {len(batch)} alerts to Discord (total: {total_sent}/{len(embeds)})")
+            except requests.exceptions.HTTPError as e:
+                print(f"Error sending Discord alert batch: {e}")
+                print(f"Response: {e.response.text if e.response is not None else 'No response'}")
+            except Exception as e:
+                print(f"Error sending Discord alert: {e}")
+            break
+        else:
+            print(f"  Failed after {max_retries} retries")
+
+        if response is not None and response.headers.get('X-RateLimit-Remaining') == '0':
+            resume_at[url] = time.monotonic() + float(response.headers.get('X-RateLimit-Reset-After', 1))
+
+    return total_sent == len(embeds)
@@ -10,110 +10,43 @@ which catches earnings that get updated or fully populated after initial detecti
 """
 
 import os
-import json
-import requests
-import time
-from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+from common import (
+    API_KEYS, MAX_WORKERS, WATCHLIST, finnhub_get, load_history,
+    prune_history, save_history, send_discord_alert
+)
 
 # Configuration
-FINNHUB_API_KEY = os.getenv('FINNHUB_API_KEY')
-FINNHUB_API_KEY_2 = os.getenv('FINNHUB_API_KEY_2')
-FINNHUB_API_KEY_3 = os.getenv('FINNHUB_API_KEY_3')
 DISCORD_WEBHOOK = os.getenv('DISCORD_WEBHOOK_EPS_SURPRISES')
 HISTORY_FILE = 'data/eps_surprises_history.json'
 
 # NEW: Alert window - only alert once within this time period for each earnings
 ALERT_WINDOW_HOURS = 48  # Re-check earnings for 48 hours after first detection
 
-# Create list of API keys (filter out None values)
-API_KEYS = [key for key in [FINNHUB_API_KEY, FINNHUB_API_KEY_2, FINNHUB_API_KEY_3] if key]
-api_key_index = 0
+# Earnings are quarterly, so once a report's alert window has closed the next one
+# is at least a couple of months away. Counted from when the report was first seen,
+# since Finnhub labels off-calendar fiscal quarters with a period that can fall
+# after the report date.
+NEXT_REPORT_MIN_DAYS = 60
+
+# Symbols to monitor - the shared watchlist plus ARM and COHR
+SYMBOLS_TO_MONITOR = WATCHLIST + ('ARM', 'COHR')
 
-def get_next_api_key():
-    """Round-robin through available API keys"""
-    global api_key_index
-    key = API_KEYS[api_key_index % len(API_KEYS)]
-    api_key_index += 1
-    return key
+# Footer shared by every alert embed
+EMBED_FOOTER = {"text": "Finnhub Earnings Surprises"}
 
-# Symbols to monitor - UPDATED with ARM, COHR, QCOM
-SYMBOLS_TO_MONITOR = [
-    'ABBV', 'ABT', 'ADBE', 'AEO', 'ALAB', 'ALGN', 'ALGT', 'AMD',
-    'AMZN', 'APP', 'ARM', 'ASTS', 'BA', 'BABA', 'BE', 'BULL',
-    'CDNS', 'CFLT', 'CMCL', 'CNC', 'COHR', 'COIN', 'COP', 'CPNG',
-    'CRWV', 'CSCO', 'CVNA', 'CVS', 'CVX', 'DUOL',
-    'ENPH', 'FIG', 'FLR', 'GE', 'GME', 'GOOGL',
-    'HIMS', 'HOOD', 'IBM', 'IBRX', 'INTC', 'IONQ',
-    'IREN', 'JNJ', 'JOBY', 'KO', 'LCID',
-    'LLY', 'LMND', 'LNTH', 'LYFT', 'MARA',
-    'META', 'MRVL', 'MSFT', 'MU', 'NEE',
-    'NFLX', 'NKE', 'NRG', 'NVAX', 'NVDA',
-    'OKLO', 'ONC', 'OPEN', 'ORCL', 'PANW',
-    'PATH', 'PEP', 'PDD', 'PFE', 'PLTR',
-    'PYPL', 'QBTS', 'QCOM', 'RGTI', 'RKLB',
-    'RR', 'SHOP', 'SMCI', 'SMR', 'SNOW',
-    'SOFI', 'SOUN', 'SPOT', 'SYNA', 'TEM',
-    'TMC', 'TSLA', 'TSM', 'TTD', 'UBER',
-    'UAMY', 'UNH', 'USAR', 'UUUU', 'XOM',
-    'XPEV', 'Z', 'ZBRA'
-]
+# Calendar quarter for each month, January first
+QUARTER_BY_MONTH = ('Q1', 'Q1', 'Q1', 'Q2', 'Q2', 'Q2', 'Q3', 'Q3', 'Q3', 'Q4', 'Q4', 'Q4')
 
 # Threshold for significant surprises (%)
 SURPRISE_THRESHOLD = 5.0
 
 
-def load_history():
-    """Load earnings history"""
-    if os.path.exists(HISTORY_FILE):
-        try:
-            with open(HISTORY_FILE, 'r') as f:
-                content = f.read().strip()
-                if content:
-                    return json.loads(content)
-                else:
-                    return {}
-        except (json.JSONDecodeError, ValueError) as e:
-            print(f"Warning: Could not parse history file, starting fresh: {e}")
-            return {}
-    return {}
-
-
-def save_history(history):
-    """Save earnings history"""
-    os.makedirs(os.path.dirname(HISTORY_FILE), exist_ok=True)
-    with open(HISTORY_FILE, 'w') as f:
-        json.dump(history, f, indent=2)
-
-
-def get_earnings_surprises(symbol, max_retries=3):
-    """Fetch earnings surprises from Finnhub with retry logic"""
-    url = 'https://finnhub.io/api/v1/stock/earnings'
-    
-    for attempt in range(max_retries):
-        params = {
-            'symbol': symbol,
-            'token': get_next_api_key()
-        }
-        
-        try:
-            response = requests.get(url, params=params, timeout=10)
-            response.raise_for_status()
-            return response.json()
-        except requests.exceptions.HTTPError as e:
-            if e.response.status_code == 429:
-                wait_time = (attempt + 1) * 5
-                print(f"  Rate limit hit, waiting {wait_time}s...")
-                time.sleep(wait_time)
-                continue
-            else:
-                print(f"Error fetching earnings for {symbol}: {e}")
-                return None
-        except Exception as e:
-            print(f"Error fetching earnings for {symbol}: {e}")
-            return None
-    
-    print(f"  Failed after {max_retries} retries")
-    return None
+def get_earnings_surprises(symbol):
+    """Fetch earnings surprises from Finnhub (rate limiting and retries live in common)"""
+    return finnhub_get('stock/earnings', {'symbol': symbol}, f"earnings for {symbol}")
 
 
 def create_earnings_id(symbol, earnings):
@@ -128,7 +61,30 @@ def calculate_surprise_pct(actual, estimate):
     return ((actual - estimate) / abs(estimate)) * 100
 
 
-def should_alert(earnings_id, history, surprise_pct):
+def needs_fetch(symbol, history, now):
+    """
+    Decide whether a symbol's earnings can have changed since the last run.
+    
+    A fetch is skipped only when the symbol's most recently seen report is past
+    its alert window and under NEXT_REPORT_MIN_DAYS old.
+    """
+    prefix = f"{symbol}_"
+    last_seen_iso = max(
+        (record.get('first_seen', '') for key, record in history.items() if key.startswith(prefix)),
+        default=''
+    )
+    if not last_seen_iso:
+        return True
+    
+    window_start_iso = (now - timedelta(hours=ALERT_WINDOW_HOURS)).isoformat()
+    if last_seen_iso >= window_start_iso:
+        return True
+    
+    next_report_iso = (now - timedelta(days=NEXT_REPORT_MIN_DAYS)).isoformat()
+    return last_seen_iso <= next_report_iso
+
+
+def should_alert(earnings_id, history, surprise_pct, now):
     """
     Determine if we should send an alert for this earnings report.
     
@@ -143,13 +99,12 @@ def should_alert(earnings_id, history, surprise_pct):
         return True
     
     record = history[earnings_id]
-    first_seen = datetime.fromisoformat(record.get('first_seen'))
     already_alerted = record.get('alerted', False)
     
-    # Check if within alert window
-    hours_since_first_seen = (datetime.utcnow() - first_seen).total_seconds() / 3600
+    # Check if within alert window (ISO-8601 timestamps compare as strings)
+    window_start_iso = (now - timedelta(hours=ALERT_WINDOW_HOURS)).isoformat()
     
-    if hours_since_first_seen <= ALERT_WINDOW_HOURS:
+    if record.get('first_seen', '') >= window_start_iso:
         # Within alert window
         if not already_alerted and abs(surprise_pct) >= SURPRISE_THRESHOLD:
             # Haven't alerted yet and it's significant
@@ -159,28 +114,18 @@ def should_alert(earnings_id, history, surprise_pct):
 
 
 def format_quarter(period_str):
-    """Format period string to readable quarter"""
+    """Format period string (YYYY-MM-DD) to readable quarter"""
     try:
-        date_obj = datetime.strptime(period_str, '%Y-%m-%d')
-        year = date_obj.year
-        month = date_obj.month
-        
-        if month in [1, 2, 3]:
-            quarter = "Q1"
-        elif month in [4, 5, 6]:
-            quarter = "Q2"
-        elif month in [7, 8, 9]:
-            quarter = "Q3"
-        else:
-            quarter = "Q4"
-        
-        return f"{quarter} {year}"
-    except:
+        year, month = int(period_str[:4]), int(period_str[5:7])
+    except (TypeError, ValueError):
+        return period_str
+    if not 1 <= month <= 12:
         return period_str
+    return f"{QUARTER_BY_MONTH[month - 1]} {year}"
 
 
-def format_discord_embed(symbol, earnings):
-    """Format earnings data as Discord embed"""
+def format_discord_embed(symbol, earnings, now):
+    """Format earnings data as Discord embed (now is the run's UTC timestamp)"""
     actual = earnings.get('actual', 0)
     estimate = earnings.get('estimate', 0)
     period = earnings.get('period', 'N/A')
@@ -206,7 +151,7 @@ def format_discord_embed(symbol, earnings):
     
     surprise_pct_str = f"{surprise_pct:+.2f}%"
     quarter_formatted = format_quarter(period)
-    report_date = datetime.now().strftime('%B %d, %Y')
+    report_date = now.astimezone().strftime('%B %d, %Y')
     
     embed = {
         "title": f"{emoji} Earnings {result}: {symbol}",
@@ -244,70 +189,51 @@ def format_discord_embed(symbol, earnings):
                 "inline": True
             }
         ],
-        "footer": {
-            "text": "Finnhub Earnings Surprises"
-        },
-        "timestamp": datetime.utcnow().isoformat()
+        "footer": EMBED_FOOTER,
+        "timestamp": now.isoformat()
     }
     
     return embed
 
 
-def send_discord_alert(embeds):
-    """Send alert to Discord webhook with proper batching and rate limiting"""
-    if not DISCORD_WEBHOOK:
-        print("Discord webhook not configured")
-        return False
-    
-    total_sent = 0
-    
-    for i in range(0, len(embeds), 10):
-        batch = embeds[i:i+10]
-        payload = {"embeds": batch}
-        
-        try:
-            response = requests.post(DISCORD_WEBHOOK, json=payload, timeout=10)
-            response.raise_for_status()
-            total_sent += len(batch)
-            print(f"Sent batch of {len(batch)} alerts to Discord (total: {total_sent}/{len(embeds)})")
-            
-            if i + 10 < len(embeds):
-                time.sleep(0.5)
-                
-        except requests.exceptions.HTTPError as e:
-            print(f"Error sending Discord alert batch: {e}")
-            print(f"Response: {e.response.text if e.response else 'No response'}")
-            continue
-        except Exception as e:
-            print(f"Error sending Discord alert: {e}")
-            continue
-    
-    return total_sent > 0
-
-
 def main():
     """Main execution function"""
     if not API_KEYS:
         print("Error: No FINNHUB_API_KEY configured")
         return
     
+    # Nothing can be alerted without a webhook, so skip all the API work
+    if not DISCORD_WEBHOOK:
+        print("Error: No DISCORD_WEBHOOK_EPS_SURPRISES configured")
+        return
+    
+    # One timestamp for the whole run
+    now = datetime.now(timezone.utc)
+    now_iso = now.isoformat()
+    
     print(f"Using {len(API_KEYS)} API key(s)")
-    print(f"Current time (UTC): {datetime.utcnow().isoformat()}")
+    print(f"Current time (UTC): {now_iso}")
     print(f"Alert window: {ALERT_WINDOW_HOURS} hours")
     
-    history = load_history()
+    history = load_history(HISTORY_FILE)
     print(f"Loaded history with {len(history)} records")
     
     print("\nChecking earnings surprises...")
     
     significant_surprises = []
     
+    # Skip symbols whose next quarter can't have been reported yet
+    symbols_to_fetch = [s for s in SYMBOLS_TO_MONITOR if needs_fetch(s, history, now)]
+    print(f"Fetching {len(symbols_to_fetch)} symbols "
+          f"({len(SYMBOLS_TO_MONITOR) - len(symbols_to_fetch)} between quarters, skipped)")
+    
+    # Fetch concurrently; results come back in symbols_to_fetch order
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        results = list(executor.map(get_earnings_surprises, symbols_to_fetch))
+    
     # Check each symbol
-    for symbol in SYMBOLS_TO_MONITOR:
+    for symbol, data in zip(symbols_to_fetch, results):
         print(f"Checking {symbol}...")
-        data = get_earnings_surprises(symbol)
-        
-        time.sleep(0.4)  # Rate limiting
         
         if data and len(data) > 0:
             latest = data[0]
@@ -321,26 +247,26 @@ def main():
                 surprise_pct = calculate_surprise_pct(actual, estimate)
             
             # NEW: Use should_alert logic
-            if should_alert(earnings_id, history, surprise_pct):
+            if should_alert(earnings_id, history, surprise_pct, now):
                 significant_surprises.append((symbol, latest))
                 print(f"  ✅ ALERT: {surprise_pct:+.2f}%")
                 
                 # Mark as alerted
                 if earnings_id not in history:
                     history[earnings_id] = {
-                        'first_seen': datetime.utcnow().isoformat(),
+                        'first_seen': now_iso,
                         'earnings': latest,
                         'alerted': True,
-                        'alerted_at': datetime.utcnow().isoformat()
+                        'alerted_at': now_iso
                     }
                 else:
                     history[earnings_id]['alerted'] = True
-                    history[earnings_id]['alerted_at'] = datetime.utcnow().isoformat()
+                    history[earnings_id]['alerted_at'] = now_iso
             else:
                 # Update history even if not alerting
                 if earnings_id not in history:
                     history[earnings_id] = {
-                        'first_seen': datetime.utcnow().isoformat(),
+                        'first_seen': now_iso,
                         'earnings': latest,
                         'alerted': False
                     }
@@ -352,21 +278,18 @@ def main():
     if significant_surprises:
         print(f"\nFound {len(significant_surprises)} significant earnings surprises")
         embeds = [
-            format_discord_embed(symbol, earnings)
+            format_discord_embed(symbol, earnings, now)
             for symbol, earnings in significant_surprises
         ]
-        send_discord_alert(embeds)
+        send_discord_alert(DISCORD_WEBHOOK, embeds)
     else:
         print("No significant earnings surprises found")
     
     # Clean up old history (keep last 2 years)
-    cutoff_date = datetime.utcnow() - timedelta(days=730)
-    history = {
-        k: v for k, v in history.items()
-        if 'first_seen' in v and datetime.fromisoformat(v['first_seen']) > cutoff_date
-    }
+    cutoff_iso = (now - timedelta(days=730)).isoformat()
+    prune_history(history, cutoff_iso)
     
-    save_history(history)
+    save_history(HISTORY_FILE, history)
     print(f"History contains {len(history)} earnings reports")
 
 
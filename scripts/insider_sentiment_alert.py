@@ -5,110 +5,55 @@ Monitors insider sentiment and sends alerts to Discord
 """
 
 import os
-import json
-import requests
-import time
-from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta, timezone
+
+from common import (
+    API_KEYS, MAX_WORKERS, WATCHLIST, cached_finnhub_get, load_history,
+    prune_history, save_history, send_discord_alert
+)
 
 # Configuration
-FINNHUB_API_KEY = os.getenv('FINNHUB_API_KEY')
-FINNHUB_API_KEY_2 = os.getenv('FINNHUB_API_KEY_2')
-FINNHUB_API_KEY_3 = os.getenv('FINNHUB_API_KEY_3')
 DISCORD_WEBHOOK = os.getenv('DISCORD_WEBHOOK_INSIDER_SENTIMENT')
 HISTORY_FILE = 'data/insider_sentiment_history.json'
+META_FILE = 'data/insider_sentiment_meta.json'  # {"last_run": "YYYY-MM-DD"} of the previous run
 
-# Create list of API keys (filter out None values)
-API_KEYS = [key for key in [FINNHUB_API_KEY, FINNHUB_API_KEY_2, FINNHUB_API_KEY_3] if key]
-api_key_index = 0
+# Symbols to monitor
+SYMBOLS_TO_MONITOR = WATCHLIST
 
-def get_next_api_key():
-    """Round-robin through available API keys"""
-    global api_key_index
-    key = API_KEYS[api_key_index % len(API_KEYS)]
-    api_key_index += 1
-    return key
+# Footer shared by every alert embed
+EMBED_FOOTER = {"text": "Finnhub Insider Sentiment"}
 
-# Symbols to monitor
-SYMBOLS_TO_MONITOR = [
-    'ABBV', 'ABT', 'ADBE', 'AEO', 'ALAB', 'ALGN', 'ALGT', 'AMD',
-    'AMZN', 'APP', 'ASTS', 'BA', 'BABA', 'BE', 'BULL',
-    'CDNS', 'CFLT', 'CMCL', 'CNC', 'COIN', 'COP', 'CPNG',
-    'CRWV', 'CSCO', 'CVNA', 'CVS', 'CVX', 'DUOL',
-    'ENPH', 'FIG', 'FLR', 'GE', 'GME', 'GOOGL',
-    'HIMS', 'HOOD', 'IBM', 'IBRX', 'INTC', 'IONQ',
-    'IREN', 'JNJ', 'JOBY', 'KO', 'LCID',
-    'LLY', 'LMND', 'LNTH', 'LYFT', 'MARA',
-    'META', 'MRVL', 'MSFT', 'MU', 'NEE',
-    'NFLX', 'NKE', 'NRG', 'NVAX', 'NVDA',
-    'OKLO', 'ONC', 'OPEN', 'ORCL', 'PANW',
-    'PATH', 'PEP', 'PDD', 'PFE', 'PLTR',
-    'PYPL', 'QBTS', 'QCOM', 'RGTI', 'RKLB',
-    'RR', 'SHOP', 'SMCI', 'SMR', 'SNOW',
-    'SOFI', 'SOUN', 'SPOT', 'SYNA', 'TEM',
-    'TMC', 'TSLA', 'TSM', 'TTD', 'UBER',
-    'UAMY', 'UNH', 'USAR', 'UUUU', 'XOM',
-    'XPEV', 'Z', 'ZBRA'
-]
+# Sentiment is published monthly, so a day-old response is still current
+CACHE_TTL_SECONDS = 24 * 60 * 60
 
 # Thresholds for significant sentiment changes
 MSPR_THRESHOLD = 5  # Alert if MSPR (monthly share purchase ratio) is >= 5
 CHANGE_THRESHOLD = 2  # Alert if change is >= 2
 
 
-def load_history():
-    """Load sentiment history"""
-    if os.path.exists(HISTORY_FILE):
-        try:
-            with open(HISTORY_FILE, 'r') as f:
-                content = f.read().strip()
-                if content:
-                    return json.loads(content)
-                else:
-                    return {}
-        except (json.JSONDecodeError, ValueError) as e:
-            print(f"Warning: Could not parse history file, starting fresh: {e}")
-            return {}
-    return {}
+def get_insider_sentiment(symbol, from_date, to_date):
+    """Fetch insider sentiment from Finnhub, served from the disk cache for CACHE_TTL_SECONDS"""
+    params = {'symbol': symbol, 'from': from_date, 'to': to_date}
+    return cached_finnhub_get('stock/insider-sentiment', params, f"sentiment for {symbol}",
+                              CACHE_TTL_SECONDS)
 
 
-def save_history(history):
-    """Save sentiment history"""
-    os.makedirs(os.path.dirname(HISTORY_FILE), exist_ok=True)
-    with open(HISTORY_FILE, 'w') as f:
-        json.dump(history, f, indent=2)
-
-
-def get_insider_sentiment(symbol, from_date, to_date, max_retries=3):
-    """Fetch insider sentiment from Finnhub with retry logic"""
-    url = 'https://finnhub.io/api/v1/stock/insider-sentiment'
+def fetch_window_start(last_run, today):
+    """
+    First date worth requesting, given when the previous run happened.
     
-    for attempt in range(max_retries):
-        params = {
-            'symbol': symbol,
-            'from': from_date,
-            'to': to_date,
-            'token': get_next_api_key()  # Use round-robin API key
-        }
-        
-        try:
-            response = requests.get(url, params=params, timeout=10)
-            response.raise_for_status()
-            return response.json()
-        except requests.exceptions.HTTPError as e:
-            if e.response.status_code == 429:  # Rate limit hit
-                wait_time = (attempt + 1) * 5  # 5, 10, 15 seconds
-                print(f"  Rate limit hit, waiting {wait_time}s...")
-                time.sleep(wait_time)
-                continue
-            else:
-                print(f"Error fetching sentiment for {symbol}: {e}")
-                return None
-        except Exception as e:
-            print(f"Error fetching sentiment for {symbol}: {e}")
-            return None
-    
-    print(f"  Failed after {max_retries} retries")
-    return None
+    Sentiment is reported per calendar month and a month can still be filled in
+    after it closes, so the window reaches back to the start of the month
+    before the last run. It never goes back more than the full 90 days.
+    """
+    window_start = today - timedelta(days=90)
+    try:
+        last_run_date = date.fromisoformat(last_run)
+    except (TypeError, ValueError):
+        return window_start
+    previous_month_start = (last_run_date.replace(day=1) - timedelta(days=1)).replace(day=1)
+    return max(window_start, previous_month_start)
 
 
 def create_sentiment_id(symbol, sentiment):
@@ -116,8 +61,8 @@ def create_sentiment_id(symbol, sentiment):
     return f"{symbol}_{sentiment.get('year')}_{sentiment.get('month')}"
 
 
-def format_discord_embed(symbol, sentiment):
-    """Format sentiment data as Discord embed"""
+def format_discord_embed(symbol, sentiment, now_iso):
+    """Format sentiment data as Discord embed (now_iso is the run's UTC timestamp)"""
     year = sentiment.get('year', 'N/A')
     month = sentiment.get('month', 'N/A')
     mspr = sentiment.get('mspr', 0)
@@ -164,67 +109,52 @@ def format_discord_embed(symbol, sentiment):
                 "inline": True
             }
         ],
-        "footer": {
-            "text": "Finnhub Insider Sentiment"
-        },
-        "timestamp": datetime.utcnow().isoformat()
+        "footer": EMBED_FOOTER,
+        "timestamp": now_iso
     }
     
     return embed
 
 
-def send_discord_alert(embeds):
-    """Send alert to Discord webhook"""
-    if not DISCORD_WEBHOOK:
-        print("Discord webhook not configured")
-        return False
-    
-    # Discord allows max 10 embeds per message
-    for i in range(0, len(embeds), 10):
-        batch = embeds[i:i+10]
-        payload = {
-            "embeds": batch
-        }
-        
-        try:
-            response = requests.post(DISCORD_WEBHOOK, json=payload, timeout=10)
-            response.raise_for_status()
-            print(f"Sent {len(batch)} alerts to Discord")
-            time.sleep(0.5)  # Small delay between batches
-        except Exception as e:
-            print(f"Error sending Discord alert: {e}")
-            return False
-    
-    return True
-
-
 def main():
     """Main execution function"""
     if not API_KEYS:
         print("Error: No FINNHUB_API_KEY configured")
         return
     
+    # Nothing can be alerted without a webhook, so skip all the API work
+    if not DISCORD_WEBHOOK:
+        print("Error: No DISCORD_WEBHOOK_INSIDER_SENTIMENT configured")
+        return
+    
     print(f"Using {len(API_KEYS)} API key(s)")
     
+    # One timestamp for the whole run
+    now = datetime.now(timezone.utc)
+    now_iso = now.isoformat()
+    
     # Load history
-    history = load_history()
+    history = load_history(HISTORY_FILE)
     
-    # Calculate date range (last 3 months)
-    to_date = datetime.now().strftime('%Y-%m-%d')
-    from_date = (datetime.now() - timedelta(days=90)).strftime('%Y-%m-%d')
+    # Calculate date range (last 3 months, narrowed to what the last run may have missed)
+    today = datetime.now().date()
+    to_date = today.isoformat()
+    from_date = fetch_window_start(load_history(META_FILE).get('last_run'), today).isoformat()
     
     print(f"Checking insider sentiment from {from_date} to {to_date}")
     
     significant_sentiments = []
     
+    # Fetch all symbols concurrently; results come back in SYMBOLS_TO_MONITOR order
+    def fetch_symbol(symbol):
+        return get_insider_sentiment(symbol, from_date, to_date)
+    
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        results = list(executor.map(fetch_symbol, SYMBOLS_TO_MONITOR))
+    
     # Check each symbol
-    for symbol in SYMBOLS_TO_MONITOR:
+    for symbol, data in zip(SYMBOLS_TO_MONITOR, results):
         print(f"Checking {symbol}...")
-        data = get_insider_sentiment(symbol, from_date, to_date)
-        
-        # Rate limit with 3 API keys: 180 API calls per minute = 0.33s per call
-        # Using 0.4s for safety buffer
-        time.sleep(0.4)
         
         if data and 'data' in data:
             for sentiment in data['data']:
@@ -242,7 +172,7 @@ def main():
                     
                     # Store the sentiment data
                     history[sentiment_id] = {
-                        'first_seen': datetime.utcnow().isoformat(),
+                        'first_seen': now_iso,
                         'sentiment': sentiment
                     }
     
@@ -250,22 +180,23 @@ def main():
     if significant_sentiments:
         print(f"\nFound {len(significant_sentiments)} significant insider sentiments")
         embeds = [
-            format_discord_embed(symbol, sentiment)
+            format_discord_embed(symbol, sentiment, now_iso)
             for symbol, sentiment in significant_sentiments
         ]
-        send_discord_alert(embeds)
+        send_discord_alert(DISCORD_WEBHOOK, embeds)
     else:
         print("No significant insider sentiments found")
     
     # Clean up old history (keep last 1 year of data)
-    cutoff_date = datetime.utcnow() - timedelta(days=365)
-    history = {
-        k: v for k, v in history.items()
-        if 'first_seen' in v and datetime.fromisoformat(v['first_seen']) > cutoff_date
-    }
+    cutoff_iso = (now - timedelta(days=365)).isoformat()
+    prune_history(history, cutoff_iso)
     
     # Save updated history
-    save_history(history)
+    save_history(HISTORY_FILE, history)
+    # Only a run that fetched something counts. Local date, matching today above,
+    # and date only so the committed file changes at most once a day.
+    if any(data is not None for data in results):
+        save_history(META_FILE, {'last_run': today.isoformat()})
     print(f"History contains {len(history)} sentiment records")
 
 
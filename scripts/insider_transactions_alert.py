@@ -9,15 +9,15 @@ ALERT THRESHOLDS:
 """
 
 import os
-import json
-import requests
-import time
-from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+from common import (
+    API_KEYS, MAX_WORKERS, WATCHLIST, cached_finnhub_get, load_history,
+    prune_history, save_history, send_discord_alert
+)
 
 # Configuration
-FINNHUB_API_KEY = os.getenv('FINNHUB_API_KEY')
-FINNHUB_API_KEY_2 = os.getenv('FINNHUB_API_KEY_2')
-FINNHUB_API_KEY_3 = os.getenv('FINNHUB_API_KEY_3')
 DISCORD_WEBHOOK = os.getenv('DISCORD_WEBHOOK_INSIDER_TRANSACTIONS')
 HISTORY_FILE = 'data/insider_transactions_history.json'
 
@@ -25,94 +25,42 @@ HISTORY_FILE = 'data/insider_transactions_history.json'
 MIN_TRANSACTION_VALUE = 100_000  # $100k
 MIN_SHARES_CHANGED = 10_000      # 10k shares
 
-# Create list of API keys (filter out None values)
-API_KEYS = [key for key in [FINNHUB_API_KEY, FINNHUB_API_KEY_2, FINNHUB_API_KEY_3] if key]
-api_key_index = 0
-
-def get_next_api_key():
-    """Round-robin through available API keys"""
-    global api_key_index
-    key = API_KEYS[api_key_index % len(API_KEYS)]
-    api_key_index += 1
-    return key
+# Filings trickle in over the day; a half-hour-old response is still fresh
+# enough, and lets most of the every-3-minute runs skip the API entirely
+CACHE_TTL_SECONDS = 30 * 60
 
 # Symbols to monitor
-SYMBOLS_TO_MONITOR = [
-    'ABBV', 'ABT', 'ADBE', 'AEO', 'ALAB', 'ALGN', 'ALGT', 'AMD',
-    'AMZN', 'APP', 'ASTS', 'BA', 'BABA', 'BE', 'BULL',
-    'CDNS', 'CFLT', 'CMCL', 'CNC', 'COIN', 'COP', 'CPNG',
-    'CRWV', 'CSCO', 'CVNA', 'CVS', 'CVX', 'DUOL',
-    'ENPH', 'FIG', 'FLR', 'GE', 'GME', 'GOOGL',
-    'HIMS', 'HOOD', 'IBM', 'IBRX', 'INTC', 'IONQ',
-    'IREN', 'JNJ', 'JOBY', 'KO', 'LCID',
-    'LLY', 'LMND', 'LNTH', 'LYFT', 'MARA',
-    'META', 'MRVL', 'MSFT', 'MU', 'NEE',
-    'NFLX', 'NKE', 'NRG', 'NVAX', 'NVDA',
-    'OKLO', 'ONC', 'OPEN', 'ORCL', 'PANW',
-    'PATH', 'PEP', 'PDD', 'PFE', 'PLTR',
-    'PYPL', 'QBTS', 'QCOM', 'RGTI', 'RKLB',
-    'RR', 'SHOP', 'SMCI', 'SMR', 'SNOW',
-    'SOFI', 'SOUN', 'SPOT', 'SYNA', 'TEM',
-    'TMC', 'TSLA', 'TSM', 'TTD', 'UBER',
-    'UAMY', 'UNH', 'USAR', 'UUUU', 'XOM',
-    'XPEV', 'Z', 'ZBRA'
-]
-
-
-def load_history():
-    """Load transaction history to avoid duplicates"""
-    if os.path.exists(HISTORY_FILE):
-        try:
-            with open(HISTORY_FILE, 'r') as f:
-                content = f.read().strip()
-                if content:
-                    return json.loads(content)
-                else:
-                    return {}
-        except (json.JSONDecodeError, ValueError) as e:
-            print(f"Warning: Could not parse history file, starting fresh: {e}")
-            return {}
-    return {}
-
-
-def save_history(history):
-    """Save transaction history"""
-    os.makedirs(os.path.dirname(HISTORY_FILE), exist_ok=True)
-    with open(HISTORY_FILE, 'w') as f:
-        json.dump(history, f, indent=2)
-
-
-def get_insider_transactions(symbol, from_date, to_date, max_retries=3):
-    """Fetch insider transactions from Finnhub with retry logic"""
-    url = 'https://finnhub.io/api/v1/stock/insider-transactions'
-    
-    for attempt in range(max_retries):
-        params = {
-            'symbol': symbol,
-            'from': from_date,
-            'to': to_date,
-            'token': get_next_api_key()  # Use round-robin API key
-        }
-        
-        try:
-            response = requests.get(url, params=params, timeout=10)
-            response.raise_for_status()
-            return response.json()
-        except requests.exceptions.HTTPError as e:
-            if e.response.status_code == 429:  # Rate limit hit
-                wait_time = (attempt + 1) * 5  # 5, 10, 15 seconds
-                print(f"  Rate limit hit, waiting {wait_time}s...")
-                time.sleep(wait_time)
-                continue
-            else:
-                print(f"Error fetching transactions for {symbol}: {e}")
-                return None
-        except Exception as e:
-            print(f"Error fetching transactions for {symbol}: {e}")
-            return None
-    
-    print(f"  Failed after {max_retries} retries")
-    return None
+SYMBOLS_TO_MONITOR = WATCHLIST
+
+# Footer shared by every alert embed
+EMBED_FOOTER = {"text": "Finnhub Insider Transactions"}
+
+# Human-readable descriptions for SEC Form 4 transaction codes
+TRANSACTION_CODE_DESCRIPTIONS = {
+    'P': 'Open Market Purchase',
+    'S': 'Open Market Sale',
+    'A': 'Grant/Award',
+    'D': 'Sale to Issuer',
+    'F': 'Tax Withholding',
+    'I': 'Discretionary Transaction',
+    'M': 'Exercise of Options',
+    'C': 'Conversion',
+    'E': 'Expiration',
+    'H': 'Held',
+    'J': 'Other',
+    'G': 'Gift',
+    'L': 'Small Acquisition',
+    'W': 'Acquisition/Disposition by Will',
+    'Z': 'Deposit/Withdrawal from Voting Trust',
+    'U': 'Tender of Shares'
+}
+
+
+def get_insider_transactions(symbol, from_date, to_date):
+    """Fetch insider transactions from Finnhub, served from the disk cache for CACHE_TTL_SECONDS"""
+    params = {'symbol': symbol, 'from': from_date, 'to': to_date}
+    return cached_finnhub_get('stock/insider-transactions', params, f"transactions for {symbol}",
+                              CACHE_TTL_SECONDS)
 
 
 def create_transaction_id(transaction):
@@ -122,41 +70,23 @@ def create_transaction_id(transaction):
 
 def get_transaction_code_description(code):
     """Get human-readable description for transaction code"""
-    code_descriptions = {
-        'P': 'Open Market Purchase',
-        'S': 'Open Market Sale',
-        'A': 'Grant/Award',
-        'D': 'Sale to Issuer',
-        'F': 'Tax Withholding',
-        'I': 'Discretionary Transaction',
-        'M': 'Exercise of Options',
-        'C': 'Conversion',
-        'E': 'Expiration',
-        'H': 'Held',
-        'J': 'Other',
-        'G': 'Gift',
-        'L': 'Small Acquisition',
-        'W': 'Acquisition/Disposition by Will',
-        'Z': 'Deposit/Withdrawal from Voting Trust',
-        'U': 'Tender of Shares'
-    }
-    return code_descriptions.get(code, 'Other Transaction')
+    return TRANSACTION_CODE_DESCRIPTIONS.get(code, 'Other Transaction')
 
 
 def is_significant_transaction(transaction):
-    """Check if transaction meets significance thresholds"""
-    change = transaction.get('change', 0)
-    transaction_price = transaction.get('transactionPrice', 0)
+    """Check if transaction meets significance thresholds ($100k+ in value OR 10k+ shares)"""
+    change = abs(transaction.get('change', 0))
     
-    # Calculate transaction value
-    transaction_value = abs(change * transaction_price) if transaction_price else 0
+    # The share count needs no price, and settles most large transactions
+    if change >= MIN_SHARES_CHANGED:
+        return True
     
-    # Check thresholds: $100k+ in value OR 10k+ shares
-    return transaction_value >= MIN_TRANSACTION_VALUE or abs(change) >= MIN_SHARES_CHANGED
+    transaction_price = transaction.get('transactionPrice', 0)
+    return bool(transaction_price) and abs(change * transaction_price) >= MIN_TRANSACTION_VALUE
 
 
-def format_discord_embed(transaction):
-    """Format transaction data as Discord embed"""
+def format_discord_embed(transaction, now_iso):
+    """Format transaction data as Discord embed (now_iso is the run's UTC timestamp)"""
     symbol = transaction.get('symbol', 'N/A')
     name = transaction.get('name', 'Unknown')
     change = transaction.get('change', 0)
@@ -230,49 +160,32 @@ def format_discord_embed(transaction):
                 "inline": True
             }
         ],
-        "footer": {
-            "text": "Finnhub Insider Transactions"
-        },
-        "timestamp": datetime.utcnow().isoformat()
+        "footer": EMBED_FOOTER,
+        "timestamp": now_iso
     }
     
     return embed
 
 
-def send_discord_alert(embeds):
-    """Send alert to Discord webhook"""
-    if not DISCORD_WEBHOOK:
-        print("Discord webhook not configured")
-        return False
-    
-    # Discord allows max 10 embeds per message
-    for i in range(0, len(embeds), 10):
-        batch = embeds[i:i+10]
-        payload = {
-            "embeds": batch
-        }
-        
-        try:
-            response = requests.post(DISCORD_WEBHOOK, json=payload, timeout=10)
-            response.raise_for_status()
-            print(f"Sent {len(batch)} alerts to Discord")
-        except Exception as e:
-            print(f"Error sending Discord alert: {e}")
-            return False
-    
-    return True
-
-
 def main():
     """Main execution function"""
     if not API_KEYS:
         print("Error: No FINNHUB_API_KEY configured")
         return
     
+    # Nothing can be alerted without a webhook, so skip all the API work
+    if not DISCORD_WEBHOOK:
+        print("Error: No DISCORD_WEBHOOK_INSIDER_TRANSACTIONS configured")
+        return
+    
     print(f"Using {len(API_KEYS)} API key(s)")
     
+    # One timestamp for the whole run
+    now = datetime.now(timezone.utc)
+    now_iso = now.isoformat()
+    
     # Load history
-    history = load_history()
+    history = load_history(HISTORY_FILE)
     
     # Calculate date range (last 7 days to catch any delayed filings)
     to_date = datetime.now().strftime('%Y-%m-%d')
@@ -282,51 +195,55 @@ def main():
     
     new_transactions = []
     
+    # Fetch all symbols concurrently; results come back in SYMBOLS_TO_MONITOR order
+    def fetch_symbol(symbol):
+        return get_insider_transactions(symbol, from_date, to_date)
+    
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        results = list(executor.map(fetch_symbol, SYMBOLS_TO_MONITOR))
+    
     # Check each symbol
-    for symbol in SYMBOLS_TO_MONITOR:
+    for symbol, data in zip(SYMBOLS_TO_MONITOR, results):
         print(f"Checking {symbol}...")
-        data = get_insider_transactions(symbol, from_date, to_date)
         
-        # Rate limit with 3 API keys: 180 API calls per minute = 0.33s per call
-        # Using 0.4s for safety buffer
-        time.sleep(0.4)
+        # Most symbols have no recent filings; skip those without further work
+        transactions = data.get('data') if data else None
+        if not transactions:
+            continue
         
-        if data and 'data' in data:
-            for transaction in data['data']:
-                transaction_id = create_transaction_id(transaction)
+        for transaction in transactions:
+            # Check if transaction is significant ($100k+ or 10k+ shares);
+            # only those can alert, so only those need to be tracked
+            if not is_significant_transaction(transaction):
+                continue
+            
+            transaction_id = create_transaction_id(transaction)
+            
+            # Check if we've seen this transaction before
+            if transaction_id not in history:
+                new_transactions.append(transaction)
+                change = transaction.get('change', 0)
+                price = transaction.get('transactionPrice', 0)
+                value = abs(change * price) if price else 0
+                print(f"  New transaction: {transaction.get('name')} - {transaction.get('transactionCode')} - {change:+,} shares (${value:,.2f})")
                 
-                # Check if we've seen this transaction before
-                if transaction_id not in history:
-                    # Check if transaction is significant ($100k+ or 10k+ shares)
-                    if is_significant_transaction(transaction):
-                        new_transactions.append(transaction)
-                        change = transaction.get('change', 0)
-                        price = transaction.get('transactionPrice', 0)
-                        value = abs(change * price) if price else 0
-                        print(f"  New transaction: {transaction.get('name')} - {transaction.get('transactionCode')} - {change:+,} shares (${value:,.2f})")
-                    
-                    history[transaction_id] = {
-                        'first_seen': datetime.utcnow().isoformat(),
-                        'transaction': transaction
-                    }
+                # Only the ID is needed to dedupe; the payload is never read back
+                history[transaction_id] = {'first_seen': now_iso}
     
     # Send alerts for new transactions
     if new_transactions:
         print(f"\nFound {len(new_transactions)} new transactions")
-        embeds = [format_discord_embed(t) for t in new_transactions]
-        send_discord_alert(embeds)
+        embeds = [format_discord_embed(t, now_iso) for t in new_transactions]
+        send_discord_alert(DISCORD_WEBHOOK, embeds)
     else:
         print("No new transactions found")
     
     # Clean up old history (keep last 30 days)
-    cutoff_date = datetime.utcnow() - timedelta(days=30)
-    history = {
-        k: v for k, v in history.items()
-        if 'first_seen' in v and datetime.fromisoformat(v['first_seen']) > cutoff_date
-    }
+    cutoff_iso = (now - timedelta(days=30)).isoformat()
+    prune_history(history, cutoff_iso)
     
     # Save updated history
-    save_history(history)
+    save_history(HISTORY_FILE, history)
     print(f"History contains {len(history)} transactions")
 
 
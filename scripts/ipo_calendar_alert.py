@@ -5,85 +5,38 @@ Alerts ONLY IPOs with CONFIRMED valuation >= $1B
 """
 
 import os
-import json
-import requests
-import time
-from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+from common import (
+    API_KEYS, cached_finnhub_get, load_history, prune_history, save_history,
+    send_discord_alert
+)
 
 # ===================== CONFIG =====================
 
-FINNHUB_API_KEY = os.getenv("FINNHUB_API_KEY")
-FINNHUB_API_KEY_2 = os.getenv("FINNHUB_API_KEY_2")
-FINNHUB_API_KEY_3 = os.getenv("FINNHUB_API_KEY_3")
+# May list several comma-separated webhooks; alert batches are spread across them
 DISCORD_WEBHOOK = os.getenv("DISCORD_WEBHOOK_IPO_CALENDAR")
 HISTORY_FILE = "data/ipo_calendar_history.json"
 
 MIN_IPO_VALUE = 1_000_000_000  # $1B
 
-# Create list of API keys (filter out None values)
-API_KEYS = [key for key in [FINNHUB_API_KEY, FINNHUB_API_KEY_2, FINNHUB_API_KEY_3] if key]
-api_key_index = 0
-
-def get_next_api_key():
-    """Round-robin through available API keys"""
-    global api_key_index
-    key = API_KEYS[api_key_index % len(API_KEYS)]
-    api_key_index += 1
-    return key
-
-# ===================== HELPERS =====================
-
-def load_history():
-    if not os.path.exists(HISTORY_FILE):
-        return {}
+# The calendar only shifts a few times a day
+CACHE_TTL_SECONDS = 6 * 60 * 60
 
-    try:
-        with open(HISTORY_FILE, "r") as f:
-            return json.load(f) or {}
-    except Exception:
-        return {}
+# Footer shared by every alert embed
+EMBED_FOOTER = {"text": "Finnhub IPO Calendar"}
 
+# Embed fields, all shown inline, in display order
+EMBED_FIELD_NAMES = ("Date", "Exchange", "Status", "Price Range", "Shares", "Value")
 
-def save_history(history):
-    os.makedirs(os.path.dirname(HISTORY_FILE), exist_ok=True)
-    with open(HISTORY_FILE, "w") as f:
-        json.dump(history, f, indent=2)
-
+# ===================== HELPERS =====================
 
-def get_ipo_calendar(from_date, to_date, max_retries=3):
-    url = "https://finnhub.io/api/v1/calendar/ipo"
-    
-    for attempt in range(max_retries):
-        params = {
-            "from": from_date,
-            "to": to_date,
-            "token": get_next_api_key()  # Use round-robin API key
-        }
-
-        try:
-            r = requests.get(url, params=params, timeout=10)
-            r.raise_for_status()
-            
-            # Rate limit with 3 API keys: 180 API calls per minute = 0.33s per call
-            # Using 0.4s for safety buffer
-            time.sleep(0.4)
-            
-            return r.json().get("ipoCalendar", [])
-        except requests.exceptions.HTTPError as e:
-            if e.response.status_code == 429:  # Rate limit hit
-                wait_time = (attempt + 1) * 5  # 5, 10, 15 seconds
-                print(f"Rate limit hit, waiting {wait_time}s...")
-                time.sleep(wait_time)
-                continue
-            else:
-                print(f"Error fetching IPO calendar: {e}")
-                return []
-        except Exception as e:
-            print(f"Error fetching IPO calendar: {e}")
-            return []
-    
-    print(f"Failed after {max_retries} retries")
-    return []
+def get_ipo_calendar(from_date, to_date):
+    """Fetch the IPO calendar, served from the disk cache for CACHE_TTL_SECONDS"""
+    params = {"from": from_date, "to": to_date}
+    data = cached_finnhub_get("calendar/ipo", params, "IPO calendar", CACHE_TTL_SECONDS)
+    return data.get("ipoCalendar", []) if data else []
 
 
 def create_ipo_id(ipo):
@@ -94,12 +47,12 @@ def is_valid_billion_dollar_ipo(ipo):
     """
     STRICT filter:
     - Value must exist
-    - Must be numeric
+    - Must be numeric (exact int/float type check; same results as isinstance here)
     - Must be >= $1B
     """
     value = ipo.get("totalSharesValue")
 
-    if not isinstance(value, (int, float)):
+    if type(value) not in (int, float):
         return False
 
     return value >= MIN_IPO_VALUE
@@ -119,7 +72,7 @@ def format_price_range(ipo):
     return "N/A"
 
 
-def format_embed(ipo, upcoming=False):
+def format_embed(ipo, now_iso, upcoming=False):
     symbol = ipo.get('symbol', 'N/A')
     name = ipo.get('name', 'Unknown Company')
     date = ipo.get("date", "N/A")
@@ -140,65 +93,42 @@ def format_embed(ipo, upcoming=False):
     # Format shares
     shares_formatted = f"{shares:,}" if isinstance(shares, (int, float)) else shares
     
+    # Same order as EMBED_FIELD_NAMES
+    field_values = (
+        date,
+        exchange,
+        status.capitalize(),
+        price_range,
+        shares_formatted,
+        format_value(value),
+    )
+    
     embed = {
         "title": f"{emoji} {status.upper()} - {symbol}",
         "description": f"**{name}**",
         "color": color,
         "fields": [
-            {
-                "name": "Date",
-                "value": date,
-                "inline": True
-            },
-            {
-                "name": "Exchange",
-                "value": exchange,
-                "inline": True
-            },
-            {
-                "name": "Status",
-                "value": status.capitalize(),
-                "inline": True
-            },
-            {
-                "name": "Price Range",
-                "value": price_range,
-                "inline": True
-            },
-            {
-                "name": "Shares",
-                "value": shares_formatted,
-                "inline": True
-            },
-            {
-                "name": "Value",
-                "value": format_value(value),
-                "inline": True
-            }
+            {"name": field_name, "value": field_value, "inline": True}
+            for field_name, field_value in zip(EMBED_FIELD_NAMES, field_values)
         ],
-        "footer": {
-            "text": "Finnhub IPO Calendar"
-        },
-        "timestamp": datetime.utcnow().isoformat()
+        "footer": EMBED_FOOTER,
+        "timestamp": now_iso
     }
 
     return embed
 
 
-def send_discord(embeds):
-    if not DISCORD_WEBHOOK:
-        print("Discord webhook not set")
-        return
+def process_ipos(ipos, upcoming, history, new_alerts, now_iso):
+    """Record unseen $1B+ IPOs in history and queue an embed for each"""
+    for ipo in ipos:
+        ipo_id = create_ipo_id(ipo)
+        if ipo_id in history:
+            continue
 
-    for i in range(0, len(embeds), 10):
-        batch = embeds[i:i + 10]
-        try:
-            r = requests.post(DISCORD_WEBHOOK, json={"embeds": batch}, timeout=10)
-            r.raise_for_status()
-            print(f"✓ Sent {len(batch)} alerts")
-            time.sleep(1)
-        except Exception as e:
-            print(f"✗ Discord send failed: {e}")
+        if is_valid_billion_dollar_ipo(ipo):
+            history[ipo_id] = {"seen": now_iso}
+            new_alerts.append(format_embed(ipo, now_iso, upcoming=upcoming))
+            print(f"✓ {ipo.get('symbol')} — {format_value(ipo['totalSharesValue'])}")
 
 # ===================== MAIN =====================
 
@@ -207,54 +137,50 @@ def main():
         print("FINNHUB_API_KEY missing")
         return
 
+    # Nothing can be alerted without a webhook, so skip all the API work
+    if not DISCORD_WEBHOOK:
+        print("DISCORD_WEBHOOK_IPO_CALENDAR missing")
+        return
+
     print(f"Using {len(API_KEYS)} API key(s)")
     
-    history = load_history()
-    today = datetime.utcnow()
+    history = load_history(HISTORY_FILE)
+
+    # One timestamp for every record, embed and date window in this run
+    now = datetime.now(timezone.utc)
+    now_iso = now.isoformat()
+    today = now.date()
 
-    recent_from = (today - timedelta(days=14)).strftime("%Y-%m-%d")
-    recent_to = today.strftime("%Y-%m-%d")
+    recent_from = (today - timedelta(days=14)).isoformat()
+    recent_to = today.isoformat()
 
     upcoming_from = recent_to
-    upcoming_to = (today + timedelta(days=60)).strftime("%Y-%m-%d")
+    upcoming_to = (today + timedelta(days=60)).isoformat()
+
+    # The two windows are independent, so fetch them at the same time
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        recent_future = executor.submit(get_ipo_calendar, recent_from, recent_to)
+        upcoming_future = executor.submit(get_ipo_calendar, upcoming_from, upcoming_to)
+        recent_ipos, upcoming_ipos = recent_future.result(), upcoming_future.result()
 
     new_alerts = []
 
     print(f"Checking recent IPOs {recent_from} → {recent_to}")
-    for ipo in get_ipo_calendar(recent_from, recent_to):
-        ipo_id = create_ipo_id(ipo)
-        if ipo_id in history:
-            continue
-
-        if is_valid_billion_dollar_ipo(ipo):
-            history[ipo_id] = {"seen": datetime.utcnow().isoformat()}
-            new_alerts.append(format_embed(ipo, upcoming=False))
-            print(f"✓ {ipo.get('symbol')} — {format_value(ipo['totalSharesValue'])}")
+    process_ipos(recent_ipos, False, history, new_alerts, now_iso)
 
     print(f"\nChecking upcoming IPOs {upcoming_from} → {upcoming_to}")
-    for ipo in get_ipo_calendar(upcoming_from, upcoming_to):
-        ipo_id = create_ipo_id(ipo)
-        if ipo_id in history:
-            continue
-
-        if is_valid_billion_dollar_ipo(ipo):
-            history[ipo_id] = {"seen": datetime.utcnow().isoformat()}
-            new_alerts.append(format_embed(ipo, upcoming=True))
-            print(f"✓ {ipo.get('symbol')} — {format_value(ipo['totalSharesValue'])}")
+    process_ipos(upcoming_ipos, True, history, new_alerts, now_iso)
 
     if new_alerts:
-        send_discord(new_alerts)
+        send_discord_alert(DISCORD_WEBHOOK, new_alerts)
     else:
         print("No confirmed $1B+ IPOs found")
 
     # Keep 90 days of history
-    cutoff = datetime.utcnow() - timedelta(days=90)
-    history = {
-        k: v for k, v in history.items()
-        if 'seen' in v and datetime.fromisoformat(v["seen"]) > cutoff
-    }
+    cutoff_iso = (now - timedelta(days=90)).isoformat()
+    prune_history(history, cutoff_iso, field="seen")
 
-    save_history(history)
+    save_history(HISTORY_FILE, history)
     print(f"History size: {len(history)}")
 
 
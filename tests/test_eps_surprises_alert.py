@@ -0,0 +1,35 @@
+import os
+import sys
+import unittest
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'scripts'))
+
+from eps_surprises_alert import needs_fetch
+
+
+class NeedsFetchTest(unittest.TestCase):
+    # Off-calendar fiscal quarter: Finnhub's period label falls after the report date
+    HISTORY = {
+        'CSCO_2026-03-31': {'first_seen': '2026-02-11T22:54:51.153064', 'alerted': False},
+    }
+
+    def test_unknown_symbol_is_fetched(self):
+        now = datetime(2026, 3, 1, tzinfo=timezone.utc)
+        self.assertTrue(needs_fetch('CSCO', {}, now))
+
+    def test_within_alert_window_is_fetched(self):
+        now = datetime(2026, 2, 12, 12, tzinfo=timezone.utc)
+        self.assertTrue(needs_fetch('CSCO', self.HISTORY, now))
+
+    def test_skipped_between_reports(self):
+        now = datetime(2026, 3, 20, tzinfo=timezone.utc)
+        self.assertFalse(needs_fetch('CSCO', self.HISTORY, now))
+
+    def test_period_after_first_seen_is_fetched_within_60_days_of_report(self):
+        now = datetime(2026, 4, 13, tzinfo=timezone.utc)
+        self.assertTrue(needs_fetch('CSCO', self.HISTORY, now))
+
+
+if __name__ == '__main__':
+    unittest.main()